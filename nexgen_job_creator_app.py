@@ -1,74 +1,428 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+import stat
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+import httpx
+import numpy as np
 import streamlit as st
-from openai import OpenAI
-from io import BytesIO
-from fpdf import FPDF
+from openai import OpenAI, OpenAIError
 
 # =========================
 #  OpenAI client
 # =========================
 # API key is stored in Streamlit Secrets as:
 # OPENAI_API_KEY = "sk-xxxxx"
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+@st.cache_resource
+def get_client():
+    """One OpenAI client per process, reusing a pooled HTTP/2 connection."""
+    return OpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        http_client=httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+            timeout=60,
+        ),
+    )
+
+
+# The first entry is the default; larger models are opt-in from the sidebar.
+MODELS = ["gpt-4o-mini", "gpt-4.1-mini", "gpt-4.1"]
+MODEL = MODELS[0]
+TEMPERATURE = 0.8
+# A full post fits comfortably; the cap stops the model from over-generating.
+MAX_TOKENS = 1200
+# Static instructions live once in the system prompt; the user message only
+# carries the form fields. This keeps input tokens down and the prompt readable.
+SYSTEM_PROMPT = (
+    "You are an expert recruiter and copywriter who writes high-conversion "
+    "LinkedIn job posts: clear, structured, easy to scan; professional, "
+    "friendly and concise.\n"
+    "Given the role details, write the post with:\n"
+    "- a 1–2 sentence hook\n"
+    "- a short company/team intro\n"
+    "- 5–8 responsibility bullets\n"
+    "- 5–8 must-have and good-to-have skill bullets\n"
+    "- 3–4 lines on culture, growth and why join\n"
+    "- a clear call to apply with a contact/email placeholder"
+)
+USER_PROMPT_TEMPLATE = (
+    "Role: {role}\n"
+    "Location: {location}\n"
+    "Experience: {experience}\n"
+    "Skills: {skills}\n"
+    "Hiring manager notes: {extra_notes}"
+)
+
+# =========================
+#  Completion cache
+# =========================
+# Completions live in a per-process in-memory store and are also written to
+# disk, so they survive restarts and memory eviction; both layers are keyed by
+# content hash and expire entries after CACHE_TTL. If the disk directory can't
+# be trusted (owned by another user, a symlink, or not writable), the disk
+# layer is skipped and only the in-memory layer is used.
+CACHE_DIR = Path("/tmp/nexgen_cache")
+CACHE_TTL = 3600  # seconds
+MEMORY_CACHE_MAX = 256
+
+
+def _cache_key(system, user, model, temperature):
+    """Stable content hash for one completion request."""
+    payload = "\x1f".join([model, system, user, repr(temperature)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_dir_ok():
+    """Make CACHE_DIR private to this user; False if it can't be trusted.
+
+    /tmp is shared, so a directory owned by someone else could be used to
+    plant cache entries. A directory we own but that is open to others
+    (e.g. created 0755 by an older version) is tightened to 0700.
+    """
+    try:
+        CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        info = os.lstat(CACHE_DIR)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(info.st_mode):
+        return False
+    if not hasattr(os, "getuid"):
+        return True
+    if info.st_uid != os.getuid():
+        return False
+    if info.st_mode & 0o077:
+        try:
+            CACHE_DIR.chmod(0o700)
+        except OSError:
+            return False
+    return True
+
+
+def _is_fresh(entry):
+    """True if a cache entry is younger than CACHE_TTL."""
+    return time.time() - entry["created"] <= CACHE_TTL
+
+
+def _read_disk_cache(key):
+    """Return the cached ``{"text", "created"}`` entry for ``key``, or None.
+
+    Expired entries are deleted as they are found.
+    """
+    if not _cache_dir_ok():
+        return None
+    path = CACHE_DIR / f"{key}.json"
+    try:
+        entry = json.loads(path.read_text("utf-8"))
+        entry = {"text": str(entry["text"]), "created": float(entry["created"])}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if not _is_fresh(entry):
+        path.unlink(missing_ok=True)
+        return None
+    return entry
+
+
+def _prune_disk_cache():
+    """Delete cache files older than CACHE_TTL so the directory stays bounded."""
+    cutoff = time.time() - CACHE_TTL
+    for path in CACHE_DIR.glob("*.json"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
+
+def _write_disk_cache(key, entry):
+    """Best-effort write; a failed cache write should never break generation."""
+    if not _cache_dir_ok():
+        return
+    try:
+        (CACHE_DIR / f"{key}.json").write_text(json.dumps(entry), "utf-8")
+    except OSError:
+        pass
+    _prune_disk_cache()
+
+
+@st.cache_resource
+def _memory_cache():
+    """In-memory layer shared by all sessions: cache key -> entry, oldest first."""
+    return {"lock": threading.Lock(), "entries": {}}
+
+
+def _remember_in_memory(key, entry):
+    """Insert ``entry``, evicting the oldest entries beyond MEMORY_CACHE_MAX."""
+    memory = _memory_cache()
+    with memory["lock"]:
+        entries = memory["entries"]
+        entries.pop(key, None)
+        entries[key] = entry
+        while len(entries) > MEMORY_CACHE_MAX:
+            entries.pop(next(iter(entries)))
+
+
+def _store_cached_post(key, text, created=None):
+    """Cache a post in memory and (best effort) on disk."""
+    entry = {"text": text, "created": time.time() if created is None else created}
+    _remember_in_memory(key, entry)
+    _write_disk_cache(key, entry)
+
+
+def _cached_entry(key):
+    """Cached completion entry for ``key`` from memory or disk, or None."""
+    memory = _memory_cache()
+    with memory["lock"]:
+        entry = memory["entries"].get(key)
+        if entry is not None and not _is_fresh(entry):
+            del memory["entries"][key]
+            entry = None
+    if entry is None:
+        entry = _read_disk_cache(key)
+        if entry is not None:
+            _remember_in_memory(key, entry)
+    return entry
+
+
+def _messages(system, user):
+    """Chat messages for a single system + user turn."""
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
 
 
 # =========================
 #  Helper functions
 # =========================
-def generate_job_post(role, location, experience, skills, extra_notes):
-    """Call OpenAI to generate a job posting text."""
-
-    user_prompt = f"""
-Create a detailed LinkedIn job post for the following role.
-
-Role: {role}
-Location: {location}
-Experience required: {experience}
-Key skills: {skills}
-Extra notes from the hiring manager: {extra_notes}
-
-Structure the post as:
-1. Strong hook line (1–2 sentences)
-2. Short intro about the company and team
-3. 5–8 bullet points on responsibilities
-4. 5–8 bullet points on must-have & good-to-have skills
-5. 3–4 lines on culture, growth, and why join us
-6. Clear CTA to apply, including contact / email placeholder.
-
-Keep tone professional, friendly and concise.
-"""
-
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are an expert recruiter and copywriter who writes high-conversion "
-                    "job posts for LinkedIn. You keep things clear, structured and easy to scan."
-                ),
-            },
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0.8,
+def build_user_prompt(role, location, experience, skills, extra_notes):
+    """Build the user message: only the variable fields, as key: value lines."""
+    return USER_PROMPT_TEMPLATE.format_map(
+        {
+            "role": role,
+            "location": location,
+            "experience": experience,
+            "skills": skills,
+            "extra_notes": extra_notes,
+        }
+    )
+
+
+def get_cached_post(user_prompt, model=MODEL):
+    """Return the post generated for this exact request within the cache TTL, or None."""
+    entry = _cached_entry(_cache_key(SYSTEM_PROMPT, user_prompt, model, TEMPERATURE))
+    return None if entry is None else entry["text"]
+
+
+def stream_job_post(user_prompt, model=MODEL, outcome=None):
+    """Yield the job post text as it streams in, caching the full text at the end.
+
+    This is the only path that calls the completions API, so every cache
+    entry is filled here. Only complete (``finish_reason == "stop"``),
+    non-empty posts are cached. Once the stream ends, ``outcome`` (if given)
+    holds its ``finish_reason`` and whether the post was ``cached``.
+    """
+    if outcome is None:
+        outcome = {}
+    stream = get_client().chat.completions.create(
+        model=model,
+        messages=_messages(SYSTEM_PROMPT, user_prompt),
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
+        stream=True,
     )
 
-    return completion.choices[0].message.content.strip()
+    parts = []
+    finish_reason = None
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            delta = choice.delta.content or ""
+            parts.append(delta)
+            yield delta
+    finally:
+        # Also runs when the consumer closes us early; stop reading from OpenAI.
+        stream.close()
+
+    text = "".join(parts).strip()
+    outcome["finish_reason"] = finish_reason
+    outcome["cached"] = finish_reason == "stop" and bool(text)
+    if outcome["cached"]:
+        key = _cache_key(SYSTEM_PROMPT, user_prompt, model, TEMPERATURE)
+        _store_cached_post(key, text)
 
 
+# =========================
+#  Semantic cache
+# =========================
+# Near-duplicate JDs reuse an earlier post, but only when role, location and
+# experience match exactly (they end up verbatim in the post); skills and
+# hiring-manager notes are compared by embedding similarity. The index only
+# stores exact-cache keys, so the post text itself lives in the cache above.
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+SIMILARITY_THRESHOLD = 0.95
+# The lookup is only an optimisation, so give up quickly rather than delay generation.
+EMBEDDING_TIMEOUT = 3  # seconds
+# Bounds the index (and each rewrite of it) to ~1.5 MB of embeddings.
+SEMANTIC_INDEX_MAX = 256
+SEMANTIC_INDEX_PATH = CACHE_DIR / "semantic_index.npz"
+_INDEX_FIELDS = ("matrix", "models", "scopes", "keys", "created")
+
+
+def semantic_scope(role, location, experience):
+    """Digest of the fields a reused post must match exactly."""
+    payload = "\x1f".join(field.strip() for field in (role, location, experience))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def fuzzy_text(skills, extra_notes):
+    """Free-text fields allowed to differ slightly between requests; "" if blank."""
+    skills, extra_notes = skills.strip(), extra_notes.strip()
+    if not (skills or extra_notes):
+        return ""
+    return f"Skills: {skills}\nHiring manager notes: {extra_notes}"
+
+
+@st.cache_resource
+def _semantic_index():
+    """Load the on-disk index once per process; callers must hold its lock."""
+    index = {
+        "lock": threading.Lock(),
+        "matrix": np.zeros((0, EMBEDDING_DIM), dtype=np.float32),
+        "models": np.array([], dtype=str),
+        "scopes": np.array([], dtype=str),
+        "keys": np.array([], dtype=str),
+        "created": np.array([], dtype=np.float64),
+    }
+    if not _cache_dir_ok():
+        return index
+    try:
+        with np.load(SEMANTIC_INDEX_PATH) as data:
+            index.update({name: data[name] for name in _INDEX_FIELDS})
+    except (OSError, ValueError, KeyError):
+        pass
+    return index
+
+
+def _save_semantic_index(index):
+    """Best-effort atomic write of the index next to the completion cache."""
+    if not _cache_dir_ok():
+        return
+    tmp_path = SEMANTIC_INDEX_PATH.with_suffix(".tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **{name: index[name] for name in _INDEX_FIELDS})
+        os.replace(tmp_path, SEMANTIC_INDEX_PATH)
+    except OSError:
+        pass
+
+
+def embed_text(text):
+    """Unit-length embedding of ``text``, or None if it is blank or the call fails."""
+    if not text.strip():
+        return None
+    try:
+        client = get_client().with_options(timeout=EMBEDDING_TIMEOUT, max_retries=0)
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    except OpenAIError:
+        return None
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def find_similar_post(user_prompt, embedding, scope, model=MODEL):
+    """Return a cached post for a near-identical request, or None.
+
+    On a hit the post is also stored under ``user_prompt``'s own cache key
+    (keeping the original timestamp), so resubmitting the same inputs is an
+    exact hit and skips the embedding call.
+    """
+    index = _semantic_index()
+    with index["lock"]:
+        matrix, models, scopes, keys = (
+            index["matrix"], index["models"], index["scopes"], index["keys"]
+        )
+    if not len(keys):
+        return None
+
+    # Rows are unit vectors, so the dot product is the cosine similarity.
+    candidates = (models == model) & (scopes == scope)
+    sims = np.where(candidates, matrix @ embedding, -1.0)
+    # Best match first; skip rows whose cache entry has since expired or been evicted.
+    for row in np.argsort(sims)[::-1]:
+        if sims[row] < SIMILARITY_THRESHOLD:
+            return None
+        entry = _cached_entry(str(keys[row]))
+        if entry is not None:
+            break
+    else:
+        return None
+
+    key = _cache_key(SYSTEM_PROMPT, user_prompt, model, TEMPERATURE)
+    _store_cached_post(key, entry["text"], created=entry["created"])
+    return entry["text"]
+
+
+def remember_post(user_prompt, embedding, scope, model=MODEL):
+    """Index a post that has just been cached, dropping expired and old entries.
+
+    Any existing row for the same cache key (e.g. a "fresh draft" resubmit)
+    is replaced rather than duplicated.
+    """
+    key = _cache_key(SYSTEM_PROMPT, user_prompt, model, TEMPERATURE)
+    now = time.time()
+    index = _semantic_index()
+    with index["lock"]:
+        others = np.flatnonzero(index["keys"] != key)
+        for name in _INDEX_FIELDS:
+            index[name] = index[name][others]
+
+        index["matrix"] = np.vstack([index["matrix"], embedding[np.newaxis, :]])
+        index["models"] = np.append(index["models"], model)
+        index["scopes"] = np.append(index["scopes"], scope)
+        index["keys"] = np.append(index["keys"], key)
+        index["created"] = np.append(index["created"], now)
+
+        # Expired rows point at cache entries that are gone anyway.
+        keep = np.flatnonzero(now - index["created"] <= CACHE_TTL)[-SEMANTIC_INDEX_MAX:]
+        for name in _INDEX_FIELDS:
+            index[name] = index[name][keep]
+        _save_semantic_index(index)
+
+
+# Normalise Windows / old-Mac line endings in one pass before layout.
+_NEWLINE_RE = re.compile(r"\r\n?")
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
 def job_post_to_pdf(text, title="Job_Posting"):
-    """Create a simple PDF from the generated text using fpdf2."""
+    """Create a simple PDF from the generated text using fpdf2; returns bytes."""
+    # Imported lazily so sessions that never build a PDF don't pay for fpdf2 at start-up.
+    from fpdf import FPDF
+
     pdf = FPDF()
+    # zlib-compress page content streams to keep the download small.
+    pdf.set_compression(True)
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
     pdf.set_title(title)
     pdf.set_font("Arial", size=11)
 
-    for line in text.split("\n"):
-        pdf.multi_cell(0, 6, line)
-        pdf.ln(1)
+    # multi_cell handles embedded newlines itself, so lay out the text in one call.
+    pdf.multi_cell(0, 6, _NEWLINE_RE.sub("\n", text))
 
-    pdf_bytes = pdf.output(dest="S").encode("latin-1")
-    return BytesIO(pdf_bytes)
+    # fpdf2 returns a bytearray; bytes keeps the cached value immutable.
+    return bytes(pdf.output())
 
 
 # =========================
@@ -86,6 +440,13 @@ st.write(
     "to share with your team or agencies."
 )
 
+model = st.sidebar.selectbox(
+    "Model",
+    MODELS,
+    index=0,
+    help="gpt-4o-mini is fastest; switch to a larger model only if the draft needs it.",
+)
+
 with st.form("job_form"):
     col1, col2 = st.columns(2)
 
@@ -115,33 +476,81 @@ with st.form("job_form"):
         height=120,
     )
 
+    fresh = st.checkbox(
+        "Generate a fresh draft",
+        help="Ignore previously generated posts for these inputs and call OpenAI again.",
+    )
+
     submitted = st.form_submit_button("Generate job post")
 
 if submitted:
     if not role.strip():
         st.error("Please enter at least a Role / Job Title.")
     else:
-        with st.spinner("Calling OpenAI and drafting your job post..."):
-            try:
-                post_text = generate_job_post(
-                    role, location, experience, skills, extra_notes
-                )
-            except Exception as e:
-                st.error(
-                    "There was an error talking to OpenAI. Please check the API key and logs."
-                )
-                st.exception(e)
-            else:
-                st.success("Done! Review your job post below 👇")
-
-                st.subheader("Generated job post")
+        user_prompt = build_user_prompt(
+            role, location, experience, skills, extra_notes
+        )
+        st.subheader("Generated job post")
+        try:
+            # Cache hits return instantly; otherwise render tokens as they arrive.
+            post_text = None if fresh else get_cached_post(user_prompt, model)
+            if post_text is not None:
                 st.write(post_text)
+            else:
+                scope = semantic_scope(role, location, experience)
+                with st.spinner("Checking for a similar earlier post..."):
+                    embedding = embed_text(fuzzy_text(skills, extra_notes))
+                    post_text = (
+                        find_similar_post(user_prompt, embedding, scope, model)
+                        if embedding is not None and not fresh
+                        else None
+                    )
+                if post_text is not None:
+                    st.caption(
+                        "Reused the draft from a request with the same role, location and "
+                        "experience and near-identical skills / notes. Tick "
+                        "“Generate a fresh draft” to write a new one."
+                    )
+                    st.write(post_text)
+                else:
+                    outcome = {}
+                    # closing() ends the OpenAI stream if a rerun interrupts rendering.
+                    with closing(stream_job_post(user_prompt, model, outcome)) as chunks:
+                        with st.spinner("Calling OpenAI and drafting your job post..."):
+                            first = next(chunks, "")
+                        streamed = st.write_stream(itertools.chain([first], chunks))
+                    # write_stream returns a list instead of a str when nothing was written.
+                    post_text = streamed.strip() if isinstance(streamed, str) else ""
+                    finish_reason = outcome.get("finish_reason")
+                    if finish_reason == "length":
+                        st.warning(
+                            f"The post hit the {MAX_TOKENS}-token limit and may be cut off; "
+                            "it was not cached."
+                        )
+                    elif finish_reason != "stop":
+                        st.warning(
+                            f"OpenAI stopped early (finish reason: {finish_reason}); "
+                            "the post was not cached."
+                        )
+                    # Only index posts that actually made it into the cache.
+                    if embedding is not None and outcome.get("cached"):
+                        remember_post(user_prompt, embedding, scope, model)
+        except Exception as e:
+            st.error(
+                "There was an error talking to OpenAI. Please check the API key and logs."
+            )
+            st.exception(e)
+        else:
+            if not post_text:
+                st.warning("OpenAI returned an empty post. Please try again.")
+            else:
+                st.success("Done! Review your job post above 👆")
 
                 # Create PDF
-                pdf_buffer = job_post_to_pdf(post_text, title=role.replace(" ", "_"))
+                pdf_bytes = job_post_to_pdf(post_text, title=role.replace(" ", "_"))
                 st.download_button(
                     label="⬇️ Download as PDF",
-                    data=pdf_buffer,
+                    data=pdf_bytes,
                     file_name=f"{role.replace(' ', '_')}_job_post.pdf",
                     mime="application/pdf",
                 )